@@ -1,16 +1,64 @@
 import sqlite3
 import json
-from typing import Dict, Any, List, Tuple, Optional
+import logging
+from typing import Any, Tuple, Optional, Mapping
+from types import MappingProxyType
 import os
-from collections import defaultdict # Import defaultdict
+import atexit
+from functools import lru_cache
+
+try:
+    from orjson import loads as _json_loads # 可选依赖，解析更快
+except ImportError:
+    _json_loads = json.loads
+
+log = logging.getLogger(__name__)
 
 DB_PATH = 'sgs_data.db'
 
-def get_db_connection():
-    """建立数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row # 让查询结果可以通过列名访问
-    return conn
+# 固定的 SQL 语句统一定义为模块常量，配合连接的语句缓存 (cached_statements) 复用已编译的语句
+_INSERT_ENTITY_SQL = 'INSERT OR IGNORE INTO entities (name, attack, defense, support, timing, response_suit, response_rank_start, response_rank_end, scope) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+_INSERT_HERO_SQL = 'INSERT OR IGNORE INTO heroes (name, max_hp) VALUES (?, ?)'
+_DELETE_INFLUENCES_SQL = 'DELETE FROM entity_influences'
+_INSERT_INFLUENCE_SQL = 'INSERT INTO entity_influences (source_entity_name, target_entity_name, required_scope) VALUES (?, ?, ?)'
+# 一次 LEFT JOIN 同时取出实体基础属性、状态、scope 及其影响关系 (不含修正值)
+# 没有影响关系的实体只产生一行，影响列为 NULL
+_SELECT_ENTITIES_SQL = '''
+    SELECT e.name, e.attack, e.defense, e.support, e.timing,
+           e.response_suit, e.response_rank_start, e.response_rank_end, e.scope,
+           i.target_entity_name, i.required_scope
+    FROM entities e
+    LEFT JOIN entity_influences i ON e.name = i.source_entity_name
+    ORDER BY e.rowid, i.influence_id
+'''
+_SELECT_HEROES_SQL = 'SELECT name, max_hp FROM heroes'
+
+# 进程内共享的数据库连接，首次使用时建立，解释器退出时关闭
+# 连接只供单线程使用: 保留 sqlite3 默认的 check_same_thread，从其他线程访问会直接报错，
+# 而不是与 populate_initial_data 的显式事务/PRAGMA 切换交错执行
+_CONN: Optional[sqlite3.Connection] = None
+
+def get_db_connection() -> sqlite3.Connection:
+    """返回共享的数据库连接 (惰性建立，不要在调用方关闭)。连接属于首次调用所在的线程，不能跨线程使用。"""
+    global _CONN
+    if _CONN is None:
+        conn = sqlite3.connect(DB_PATH, cached_statements=256)
+        # 使用默认的 tuple 行，调用方按列位置解包，省去 sqlite3.Row 的构造开销
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-100000') # 约 100MB 页缓存
+        conn.execute('PRAGMA temp_store=MEMORY')
+        _CONN = conn
+    return _CONN
+
+def close_db_connection():
+    """关闭共享连接。删除或替换数据库文件前必须先调用，之后的 get_db_connection() 会重新连接。"""
+    global _CONN
+    if _CONN is not None:
+        _CONN.close()
+        _CONN = None
+
+atexit.register(close_db_connection)
 
 def initialize_database():
     """初始化数据库表，影响表不再存储具体修正值"""
@@ -43,6 +91,9 @@ def initialize_database():
         -- Modifiers (attack_modifier, etc.) are removed as they are now learnable weights
     )
     ''')
+    # 按来源 (及作用域) 查找影响关系，以及按目标反查
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_infl_src_scope ON entity_influences (source_entity_name, required_scope)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_infl_tgt ON entity_influences (target_entity_name)')
 
     # heroes 表保持不变
     cursor.execute('''
@@ -53,121 +104,166 @@ def initialize_database():
     ''')
 
     conn.commit()
-    conn.close()
-    print("数据库表已初始化/更新 (影响表不含修正值)。")
+    invalidate_caches()
+    log.debug("数据库表已初始化/更新 (影响表不含修正值)。")
+
+# --- 初始数据 ---
+# (name, attack, defense, support, timing, response_suit, response_rank_start, response_rank_end, scope)
+INITIAL_ENTITIES = (
+    ('杀', 1.0, 0.0, 0.0, 0, None, None, None, None),
+    ('过河拆桥', 0.0, 0.0, 1.0, 0, None, None, None, [1, 2, 3]),
+    ('顺手牵羊', 0.0, 0.0, 1.0, 0, None, None, None, [1, 2]),
+    ('闪电', 0.0, 0.0, 0.0, 2, 1, 2, 9, None),
+    ('闪', 0.0, 1.0, 0.0, None, None, None, None, None),
+    ('桃', 0.0, 0.0, 1.0, 0, None, None, None, None),
+)
+
+# (source, target, required_scope) - Modifiers removed
+INITIAL_INFLUENCES = (
+    ('过河拆桥', '杀', 1),
+    ('过河拆桥', '顺手牵羊', 2),
+    ('顺手牵羊', '杀', 1),
+)
+
+INITIAL_HEROES = (
+    ('白板1', 4),
+    ('白板2', 4),
+)
+
+def _entity_rows():
+    """逐行生成 entities 表的插入参数，scope 列表在此转换为 JSON 字符串"""
+    for *columns, scope in INITIAL_ENTITIES:
+        yield (*columns, json.dumps(scope) if scope else None)
 
 def populate_initial_data():
     """填充初始数据，影响数据不含具体修正值"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # (name, attack, defense, support, timing, response_suit, response_rank_start, response_rank_end, scope_json)
-    entities_data = [
-        ('杀', 1.0, 0.0, 0.0, 0, None, None, None, None),
-        ('过河拆桥', 0.0, 0.0, 1.0, 0, None, None, None, json.dumps([1, 2, 3])),
-        ('顺手牵羊', 0.0, 0.0, 1.0, 0, None, None, None, json.dumps([1, 2])),
-        ('闪电', 0.0, 0.0, 0.0, 2, 1, 2, 9, None),
-        ('闪', 0.0, 1.0, 0.0, None, None, None, None, None),
-        ('桃', 0.0, 0.0, 1.0, 0, None, None, None, None),
-    ]
-
-    # (source, target, required_scope) - Modifiers removed
-    influences_data = [
-        ('过河拆桥', '杀', 1),
-        ('过河拆桥', '顺手牵羊', 2),
-        ('顺手牵羊', '杀', 1),
-    ]
-
-    heroes_data = [
-        ('白板1', 4),
-        ('白板2', 4),
-    ]
-
+    # 批量写入: 关闭同步刷盘 (数据可随时由本函数重建)，整个填充过程放在一个显式事务中
+    # journal_mode=WAL 与 temp_store=MEMORY 已在 get_db_connection() 中设置
+    conn.execute('PRAGMA synchronous=OFF')
     try:
-        print("Inserting entities...")
-        cursor.executemany('INSERT OR IGNORE INTO entities (name, attack, defense, support, timing, response_suit, response_rank_start, response_rank_end, scope) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', entities_data)
-        print("Entities inserted.")
+        conn.execute('BEGIN')
+        log.debug("Inserting entities...")
+        cursor.executemany(_INSERT_ENTITY_SQL, _entity_rows()) # 生成器逐行绑定，不物化整个参数列表
+        log.debug("Entities inserted.")
 
-        print("Inserting heroes...")
-        cursor.executemany('INSERT OR IGNORE INTO heroes (name, max_hp) VALUES (?, ?)', heroes_data)
-        print("Heroes inserted.")
+        log.debug("Inserting heroes...")
+        cursor.executemany(_INSERT_HERO_SQL, INITIAL_HEROES)
+        log.debug("Heroes inserted.")
 
         # Clear existing influences before inserting new ones to avoid duplicates if script is run multiple times
         # This is important if populate_initial_data is called after schema changes or multiple times
-        print("Clearing old influences (if any)...")
-        cursor.execute('DELETE FROM entity_influences')
-        print("Cleared old influences.")
+        log.debug("Clearing old influences (if any)...")
+        cursor.execute(_DELETE_INFLUENCES_SQL)
+        log.debug("Cleared old influences.")
 
-        print("Inserting influence relationships...")
-        cursor.executemany('INSERT INTO entity_influences (source_entity_name, target_entity_name, required_scope) VALUES (?, ?, ?)', influences_data)
-        print("Influence relationships inserted.")
+        log.debug("Inserting influence relationships...")
+        cursor.executemany(_INSERT_INFLUENCE_SQL, INITIAL_INFLUENCES)
+        log.debug("Influence relationships inserted.")
 
         conn.commit()
-        print("初始实体、英雄和影响关系数据已填充/更新。")
+        invalidate_caches() # 数据已变化，丢弃旧的加载结果
+        log.debug("初始实体、英雄和影响关系数据已填充/更新。")
     except sqlite3.Error as e:
-        print(f"填充数据时发生数据库错误: {e}")
+        log.error("填充数据时发生数据库错误: %s", e)
         conn.rollback()
     except Exception as e:
-        print(f"填充数据时发生未知错误: {e}")
+        log.error("填充数据时发生未知错误: %s", e)
         conn.rollback()
     finally:
-        conn.close()
+        conn.execute('PRAGMA synchronous=NORMAL')
+
+def _parse_scope(name: str, scope_json: Optional[str]) -> Optional[Tuple[int, ...]]:
+    """将数据库中的 scope JSON 字符串解析为 tuple；为空或格式错误时返回 None"""
+    if not scope_json:
+        return None
+    try:
+        scope = _json_loads(scope_json)
+    except ValueError: # json.JSONDecodeError 与 orjson.JSONDecodeError 均为 ValueError 子类
+        log.warning("Could not decode scope JSON for '%s': %s. Setting to None.", name, scope_json)
+        return None
+    if not isinstance(scope, list):
+        log.warning("Scope for '%s' is not a list after JSON parsing: %s. Setting to None.", name, scope)
+        return None
+    return tuple(scope)
+
+@lru_cache(maxsize=1)
+def _load_static_data() -> Tuple[Mapping[str, Mapping[str, Any]], Mapping[str, Mapping[str, Any]]]:
+    """一次性读取实体 (含影响关系) 与英雄模板，结果在进程内缓存。
+    读取前通过 backup 把磁盘数据库整体载入一个临时内存副本，两条查询都在副本上执行，读取完毕即关闭副本；
+    此后的加载都命中缓存，只有 invalidate_caches() 之后才会再次读取。
+    """
+    mem_conn = sqlite3.connect(':memory:')
+    try:
+        get_db_connection().backup(mem_conn)
+        entities = _read_entities(mem_conn)
+        heroes = MappingProxyType({
+            name: MappingProxyType({'name': name, 'max_hp': max_hp})
+            for name, max_hp in mem_conn.execute(_SELECT_HEROES_SQL)
+        })
+    finally:
+        mem_conn.close()
+    return entities, heroes
 
-def load_entities_from_db() -> Dict[str, Any]:
-    """从数据库加载所有实体及其影响关系 (不含修正值)"""
+def _read_entities(conn: sqlite3.Connection) -> Mapping[str, Mapping[str, Any]]:
+    """执行实体查询并组装为只读映射"""
     entities = {}
-    conn = get_db_connection()
     cursor = conn.cursor()
 
-    # 加载实体基础属性、状态和 scope
-    cursor.execute('SELECT name, attack, defense, support, timing, response_suit, response_rank_start, response_rank_end, scope FROM entities')
-    entity_rows = cursor.fetchall()
-    for row in entity_rows:
-        entities[row['name']] = {
-            'attributes': {'attack': row['attack'], 'defense': row['defense'], 'support': row['support']},
-            'potential_influences': defaultdict(list), # 重命名: 存储潜在影响目标和范围
-            'timing': row['timing'],
-            'response_suit': row['response_suit'],
-            'response_rank_start': row['response_rank_start'],
-            'response_rank_end': row['response_rank_end'],
-            'scope': row['scope'] # Load scope as JSON string initially
-        }
-
-    # 加载影响关系 (不含修正值)
-    cursor.execute('''
-        SELECT source_entity_name, target_entity_name, required_scope
-        FROM entity_influences
-    ''')
-    influence_rows = cursor.fetchall()
-    for row in influence_rows:
-        source_name = row['source_entity_name']
-        target_name = row['target_entity_name']
-        required_scope = row['required_scope']
-        if source_name in entities:
+    cursor.execute(_SELECT_ENTITIES_SQL)
+    # 直接迭代游标逐行读取 (不调用 fetchall)，不会先把整个结果集物化成列表
+    for (name, attack, defense, support, timing, response_suit, rank_start, rank_end, scope_json,
+         target_name, required_scope) in cursor:
+        entity = entities.get(name)
+        if entity is None:
+            entity = entities[name] = {
+                'attributes': {'attack': attack, 'defense': defense, 'support': support},
+                'potential_influences': {}, # 重命名: 存储潜在影响目标和范围
+                'timing': timing,
+                'response_suit': response_suit,
+                'response_rank_start': rank_start,
+                'response_rank_end': rank_end,
+                'scope': _parse_scope(name, scope_json) # Optional[Tuple[int, ...]]，加载时解析一次
+            }
+        if target_name is not None:
             # 存储目标实体名称和所需的作用域列表
-            entities[source_name]['potential_influences'][target_name].append(required_scope)
-            # Example: entities['过河拆桥']['potential_influences']['杀'] = [1]
-            # Example: entities['过河拆桥']['potential_influences']['顺手牵羊'] = [2]
+            entity['potential_influences'].setdefault(target_name, []).append(required_scope)
 
-    conn.close()
-    print(f"从数据库加载了 {len(entities)} 种实体的基础信息和影响关系。")
-    return entities
+    # 加载完成后冻结结果 (只读映射，作用域与影响范围均为 tuple)：缓存的同一份数据可在多局游戏间共享，无需防御性复制
+    for name, entity in entities.items():
+        entity['attributes'] = MappingProxyType(entity['attributes'])
+        entity['potential_influences'] = MappingProxyType({
+            target_name: tuple(scopes) for target_name, scopes in entity['potential_influences'].items()
+        })
+        # Example: entities['过河拆桥']['potential_influences'] == {'杀': (1,), '顺手牵羊': (2,)}
+        entities[name] = MappingProxyType(entity)
 
-def load_hero_template(name: str) -> Optional[Dict[str, Any]]:
-    """从数据库加载指定名称的英雄模板数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, max_hp FROM heroes WHERE name = ?', (name,))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        return dict(row)
-    return None
+    log.debug("从数据库加载了 %d 种实体的基础信息和影响关系。", len(entities))
+    return MappingProxyType(entities)
+
+def load_entities_from_db() -> Mapping[str, Mapping[str, Any]]:
+    """从数据库加载所有实体及其影响关系 (不含修正值)。
+    实体表是静态游戏数据，结果在进程内缓存并以只读映射返回；数据库重建后需调用 invalidate_caches()。
+    """
+    return _load_static_data()[0]
+
+def load_hero_template(name: str) -> Optional[Mapping[str, Any]]:
+    """从数据库加载指定名称的英雄模板数据 (结果在进程内缓存，返回只读映射)"""
+    return _load_static_data()[1].get(name)
+
+def invalidate_caches():
+    """清空 load_* 函数的进程内缓存 (数据库被重建或重新填充后调用)"""
+    _load_static_data.cache_clear()
 
 if __name__ == '__main__':
+    # 命令行运行时显示各步骤的 debug 输出
+    logging.basicConfig(level=logging.DEBUG, format='%(message)s')
     # --- 确保测试/初始化时的干净状态 ---
     if os.path.exists(DB_PATH):
         print(f"删除旧数据库文件: {DB_PATH}")
+        close_db_connection()
         try:
             os.remove(DB_PATH)
             print("旧数据库文件已删除。")
@@ -188,8 +284,7 @@ if __name__ == '__main__':
         loaded_entities = load_entities_from_db()
         print("\n加载的实体数据示例 (仅含关系):")
         import pprint
-        # Convert defaultdict back to dict for cleaner printing if needed
-        pprint.pprint({k: dict(v) for k, v in loaded_entities.items()})
+        pprint.pprint(loaded_entities)
         hero1_template = load_hero_template('白板1')
         print("\n加载的英雄模板示例:")
         pprint.pprint(hero1_template)
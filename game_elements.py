@@ -1,28 +1,52 @@
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional, Tuple, Union # Add Union
-import json
-from collections import defaultdict
+import sys
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Tuple, Union, Mapping # Add Union
+import numpy as np
 import torch # Import torch
 
 # --- Global variable to hold learnable weights ---
-# Structure will be defined and populated in training.py
-# Example: Dict[source_name, Dict[target_name, Dict[scope_key, Dict[attr_name, tensor]]]]
+# Structure will be defined and populated in training.py:
+# a ParameterDict holding one (num_edges, 3) Parameter (columns attack, defense, support),
+# and influence_edge_index mapping (source_name, target_name, scope_key) -> row of that table
 influence_weights: Optional[torch.nn.ParameterDict] = None # Placeholder
+influence_edge_index: Dict[Tuple[str, str, str], int] = {}
 
-@dataclass
 class AttributeSet:
-    """存储基础属性，并支持加法用于应用影响"""
-    attack: float = 0.0
-    defense: float = 0.0
-    support: float = 0.0
+    """存储基础属性，并支持加法用于应用影响。
+    三个属性保存为 Python float (构造、字段访问和加法都没有 numpy 开销)；
+    批量运算需要的长度为 3 的 float64 数组 v (attack, defense, support) 在首次访问时生成并缓存，
+    float64 保证与数据库中的 REAL 值完全一致。视为不可变对象，不要修改字段。
+    """
+    __slots__ = ('attack', 'defense', 'support', '_v')
+
+    def __init__(self, attack: float = 0.0, defense: float = 0.0, support: float = 0.0):
+        self.attack = float(attack)
+        self.defense = float(defense)
+        self.support = float(support)
+        self._v = None
+
+    @property
+    def v(self) -> np.ndarray:
+        if self._v is None:
+            v = np.array([self.attack, self.defense, self.support])
+            v.flags.writeable = False # 与 float 字段保持一致，原型中的属性不可被就地修改
+            self._v = v
+        return self._v
+
+    def __repr__(self) -> str:
+        return f"AttributeSet(attack={self.attack}, defense={self.defense}, support={self.support})"
+
+    def __eq__(self, other):
+        if isinstance(other, AttributeSet):
+            return (self.attack, self.defense, self.support) == (other.attack, other.defense, other.support)
+        return NotImplemented
 
     def __add__(self, other):
         if isinstance(other, AttributeSet):
-            return AttributeSet(
-                attack=self.attack + other.attack,
-                defense=self.defense + other.defense,
-                support=self.support + other.support
-            )
+            return AttributeSet(self.attack + other.attack,
+                                self.defense + other.defense,
+                                self.support + other.support)
         # Allow adding a tensor-based AttributeSet (for gradients)
         elif isinstance(other, TensorAttributeSet):
              # Convert self to tensor before adding
@@ -42,7 +66,7 @@ class AttributeSet:
             return self.__add__(other)
 
 
-@dataclass
+@dataclass(slots=True, eq=False) # 张量逐元素比较没有意义，不生成 __eq__
 class TensorAttributeSet:
     """AttributeSet using PyTorch tensors for gradient tracking."""
     attack: torch.Tensor = field(default_factory=lambda: torch.tensor(0.0, dtype=torch.float32))
@@ -77,53 +101,115 @@ class TensorAttributeSet:
 
 
 # ActionEntity now describes potential influences, not their learned values
-@dataclass
+# 原型是共享的不可变对象 (flyweight)：同名手牌都指向同一个原型，按身份比较/哈希
+@dataclass(frozen=True, slots=True, eq=False)
 class ActionEntity:
     """代表一个可执行的动作实体（卡牌或技能），包含状态信息和潜在影响关系"""
     name: str
-    base_attributes: AttributeSet
+    # 基础属性存放在 BASE_ATTRS_ARRAY 的第 base_attrs_idx 行 (即 ENTITY_INDEX[name])，原型本身不持有属性对象
+    base_attrs_idx: int
     # 潜在影响: 指明此实体 *可能* 影响哪些目标实体，以及所需的作用域
-    # Key: target_entity_name, Value: List of required_scopes (int or None)
-    # Example: {'杀': [1], '顺手牵羊': [2]} for '过河拆桥'
-    potential_influences: Dict[str, List[Optional[int]]] = field(default_factory=lambda: defaultdict(list))
+    # Key: target_entity_name, Value: tuple of required_scopes (int or None)
+    # Example: {'杀': (1,), '顺手牵羊': (2,)} for '过河拆桥'
+    potential_influences: Mapping[str, Tuple[Optional[int], ...]] = field(default_factory=dict)
     timing: Optional[int] = None
     response_suit: Optional[int] = None
     response_rank_range: Optional[Tuple[int, int]] = None
-    scope: Optional[List[int]] = None # 可选作用域
-
-@dataclass
+    scope: Optional[Tuple[int, ...]] = None # 可选作用域 (只读 tuple，所有同名手牌共享)
+    # potential_influences 的整数索引形式 (加载原型时预计算，与其逐条对应):
+    # 目标实体在 ENTITY_INDEX 中的行号，以及对应的 required_scope (None 记为 NO_SCOPE)
+    influence_target_idx: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+    influence_required_scope: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+
+    @property
+    def base_attributes(self) -> AttributeSet:
+        """兼容接口: 由 BASE_ATTRS_ARRAY 中对应行构造的 AttributeSet，其 v 是该行的只读视图。
+        热路径应直接按 base_attrs_idx 读取 BASE_ATTRS_ARRAY。
+        """
+        row = BASE_ATTRS_ARRAY[self.base_attrs_idx]
+        attributes = AttributeSet(*row.tolist())
+        attributes._v = row
+        return attributes
+
+# 武将与玩家都是不可变的值对象 (frozen + slots)：状态变化 (如扣血、换手牌) 用 dataclasses.replace 生成新对象，
+# 所以派生数据 (1 / max_hp、手牌预处理) 可以在对象上只算一次，永远不会过期
+@dataclass(frozen=True, slots=True, eq=False)
 class Hero:
     """代表一个武将 (简化版，无技能)"""
     name: str
     max_hp: int
     current_hp: int
     # skills: List[Skill] = field(default_factory=list) # 暂无技能
+    # 1 / max_hp (max_hp <= 0 时为 0)，构造时计算一次
+    inv_max_hp: float = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'inv_max_hp', 1.0 / self.max_hp if self.max_hp > 0 else 0.0)
 
     def get_hp_ratio(self) -> float:
         """计算当前血量百分比"""
-        return self.current_hp / self.max_hp if self.max_hp > 0 else 0
+        return self.current_hp * self.inv_max_hp
 
-@dataclass
+@dataclass(frozen=True, slots=True, eq=False) # 玩家/武将按身份比较，实例不带 __dict__
 class Player:
     """代表一个玩家"""
     name: str
     hero: Hero
-    hand: List[ActionEntity] = field(default_factory=list) # 手牌现在是 ActionEntity 列表
+    hand: Tuple[ActionEntity, ...] = () # 手牌是 ActionEntity 元组 (构造时传入的列表等可迭代对象会转换为元组)
+    # game_logic.find_best_sequence 的手牌缓存: (手牌 Zobrist 哈希, 预处理结果或 None)，首次搜索时惰性填充；
+    # 手牌不可变，缓存无需失效检查。这是唯一允许在构造后写入的字段 (通过 object.__setattr__)
+    _choices_cache: Optional[Tuple[int, Optional[Tuple]]] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not isinstance(self.hand, tuple):
+            object.__setattr__(self, 'hand', tuple(self.hand))
 
 # --- 实体定义加载器 ---
 ACTION_ENTITY_PROTOTYPES: Dict[str, ActionEntity] = {}
 
-def load_action_entity_prototypes(entity_data_from_db: Dict[str, Any]):
+# --- 实体属性的结构化数组 (SoA)，随原型一起重建 ---
+# ENTITY_INDEX: 实体名称 -> 实体 id (即 BASE_ATTRS_ARRAY 的行号，也是 ActionEntity.base_attrs_idx)
+# BASE_ATTRS_ARRAY: (实体数, 3) 只读 float64 数组 (与 AttributeSet.v 一致)，列顺序为 attack, defense, support；
+# 所有原型的基础属性都只存在这里。game_logic.find_best_sequence 按 id 取行，一次矩阵乘法得到整手牌的基础得分。
+# 重新加载原型会替换该数组，旧的原型对象随之失效，不应继续使用。
+ENTITY_INDEX: Dict[str, int] = {}
+BASE_ATTRS_ARRAY: np.ndarray = np.zeros((0, 3))
+NO_SCOPE = -1 # required_scope 为 None 时在影响数组中的取值
+
+def _build_influence_arrays(potential_influences: Mapping[str, Tuple[Optional[int], ...]]) -> Tuple[np.ndarray, np.ndarray]:
+    """将一个实体的潜在影响转换为 (目标行号, 所需作用域) 两个 int32 数组；目标不存在的影响被跳过"""
+    tgt_idx: List[int] = []
+    required_scopes: List[int] = []
+    for target_name, scopes in potential_influences.items():
+        target_row = ENTITY_INDEX.get(target_name)
+        if target_row is None:
+            continue # 目标实体不存在，与 initialize_influence_weights 的处理一致
+        for required_scope in scopes:
+            tgt_idx.append(target_row)
+            required_scopes.append(NO_SCOPE if required_scope is None else required_scope)
+    return np.asarray(tgt_idx, dtype=np.int32), np.asarray(required_scopes, dtype=np.int32)
+
+def load_action_entity_prototypes(entity_data_from_db: Mapping[str, Mapping[str, Any]]):
     """使用从数据库加载的数据填充 ACTION_ENTITY_PROTOTYPES，构建潜在影响关系"""
-    global ACTION_ENTITY_PROTOTYPES
+    global ACTION_ENTITY_PROTOTYPES, ENTITY_INDEX, BASE_ATTRS_ARRAY
     ACTION_ENTITY_PROTOTYPES = {} # 清空旧数据
+    # 先确定行号，影响关系才能在创建原型时直接解析为整数索引
+    ENTITY_INDEX = {sys.intern(name): i for i, name in enumerate(entity_data_from_db)}
+    base_attrs_array = np.zeros((len(ENTITY_INDEX), 3))
 
     for name, data in entity_data_from_db.items():
-        base_attrs = AttributeSet(**data['attributes'])
+        name = sys.intern(name) # 名称驻留，字典查找/比较可走指针相等的快速路径
+        base_attrs_idx = ENTITY_INDEX[name]
+        attributes = data['attributes']
+        base_attrs_array[base_attrs_idx] = (attributes['attack'], attributes['defense'], attributes['support'])
 
         # Build potential influences dict directly from loaded data
         # The loaded data structure from modified database.py matches this
-        potential_influences_dict = data.get('potential_influences', defaultdict(list))
+        # 目标名称同样驻留，与 ENTITY_INDEX 的键和原型名称是同一个对象 (训练中的影响边查找也因此走快速路径)
+        potential_influences_dict = MappingProxyType({
+            sys.intern(target_name): scopes for target_name, scopes in data.get('potential_influences', {}).items()
+        })
+        influence_target_idx, influence_required_scope = _build_influence_arrays(potential_influences_dict)
 
         timing = data.get('timing')
         response_suit = data.get('response_suit')
@@ -133,36 +219,29 @@ def load_action_entity_prototypes(entity_data_from_db: Dict[str, Any]):
         if response_rank_start is not None and response_rank_end is not None:
             response_rank_range = (response_rank_start, response_rank_end)
 
-        # Load and parse scope from JSON string or keep as None
-        scope_json = data.get('scope')
-        scope = None
-        if scope_json:
-            try:
-                scope = json.loads(scope_json)
-                if not isinstance(scope, list):
-                    print(f"Warning: Scope for '{name}' is not a list after JSON parsing: {scope}. Setting to None.")
-                    scope = None
-            except json.JSONDecodeError:
-                print(f"Warning: Could not decode scope JSON for '{name}': {scope_json}. Setting to None.")
-                scope = None
+        # scope is already parsed and validated to Optional[Tuple[int, ...]] by database.load_entities_from_db
+        scope = data.get('scope')
 
         ACTION_ENTITY_PROTOTYPES[name] = ActionEntity(
             name=name,
-            base_attributes=base_attrs,
+            base_attrs_idx=base_attrs_idx,
             potential_influences=potential_influences_dict, # Assign the loaded relationships
             timing=timing,
             response_suit=response_suit,
             response_rank_range=response_rank_range,
-            scope=scope # Assign loaded scope
+            scope=scope, # Assign loaded scope
+            influence_target_idx=influence_target_idx,
+            influence_required_scope=influence_required_scope
         )
+    base_attrs_array.flags.writeable = False
+    BASE_ATTRS_ARRAY = base_attrs_array
     print(f"已创建 {len(ACTION_ENTITY_PROTOTYPES)} 个动作实体原型 (含潜在影响关系)。")
 
 def get_action_entity_instance(name: str) -> ActionEntity:
-    """获取指定名称动作实体的一个实例 (当前直接返回原型)"""
+    """获取指定名称动作实体的一个实例 (直接返回共享的不可变原型，不做复制)"""
     prototype = ACTION_ENTITY_PROTOTYPES.get(name)
     if prototype:
-        # For now, return prototype directly. If ActionEntity instances needed state,
-        # a copy mechanism (e.g., copy.deepcopy) might be required here.
+        # Prototypes are frozen flyweights; per-instance state belongs on Player/Hero, not here.
         return prototype
     else:
         raise ValueError(f"未找到名为 '{name}' 的动作实体原型")
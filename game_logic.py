@@ -1,13 +1,21 @@
-import itertools
-from typing import List, Tuple, Dict, Optional, Union # Add Union
-from collections import defaultdict
-import torch # Need torch for tensor operations
+from typing import Any, List, Tuple, Dict, Optional, Union, Callable # Add Union
+from collections import Counter, OrderedDict
+from functools import lru_cache
+import random
+import numpy as np
 
 # Use ge prefix for clarity and access to global weights/prototypes
 import game_elements as ge
-from game_elements import ActionEntity, AttributeSet, Player, Hero, TensorAttributeSet
-# Import function to get learned modifiers from training module
-from training import get_influence_modifier_tensor
+from game_elements import ActionEntity, AttributeSet, Player
+from database import load_entities_from_db
+# 学习到的修正值由 training.get_influence_modifier_matrix 提供；training 依赖本模块 (calculate_weights)，
+# 所以不在顶层导入，而是在 find_best_sequence 中延迟导入 (见 modifier_fn 参数)
+
+# --- Prototype initialization (explicit, never at import time) ---
+def ensure_prototypes_loaded():
+    """原型尚未加载时从数据库加载一次 (已加载时只是一次字典真值判断)。main.py 启动时显式调用。"""
+    if not ge.ACTION_ENTITY_PROTOTYPES:
+        ge.load_action_entity_prototypes(load_entities_from_db())
 
 # --- Probability Model and Deck (Keep as is) ---
 INITIAL_DECK_COMPOSITION = {
@@ -18,6 +26,9 @@ INITIAL_DECK_COMPOSITION = {
     "桃": 5,
     "闪电": 1,
 }
+# 默认牌堆的派生常量 (模块加载时算一次): 牌名集合，以及作为缓存键的 (牌名, 张数) 元组
+INITIAL_DECK_KEYSET = frozenset(INITIAL_DECK_COMPOSITION)
+_INITIAL_DECK_KEY = tuple(INITIAL_DECK_COMPOSITION.items())
 
 def estimate_opponent_hand_probabilities(
     known_entities: List[str],
@@ -26,94 +37,112 @@ def estimate_opponent_hand_probabilities(
 ) -> Dict[str, float]:
     """
     根据已知实体和对手手牌数，估计对手手牌中各种实体的概率
+    结果只取决于已知实体的多重集合，排序后作为缓存键；每次返回新的 dict，调用方可以随意修改
     """
-    remaining_deck = initial_deck.copy()
-    for entity_name in known_entities:
-        if entity_name in remaining_deck and remaining_deck[entity_name] > 0:
-            remaining_deck[entity_name] -= 1
+    if opponent_hand_size <= 0:
+        return {}
+    if initial_deck is INITIAL_DECK_COMPOSITION:
+        deck_key, deck_names = _INITIAL_DECK_KEY, INITIAL_DECK_KEYSET
+    else:
+        deck_key = tuple(initial_deck.items()) # 保留牌堆的插入顺序，返回的 dict 顺序与原来一致
+        deck_names = initial_deck.keys()
+    # 不在牌堆中的实体 (如技能) 不影响结果，不计入缓存键，避免无关实体分裂缓存
+    known_key = tuple(sorted(name for name in known_entities if name in deck_names))
+    return dict(_estimate_probabilities(known_key, deck_key))
 
+@lru_cache(maxsize=4096)
+def _estimate_probabilities(
+    known_key: Tuple[str, ...],
+    deck_key: Tuple[Tuple[str, int], ...]
+) -> Tuple[Tuple[str, float], ...]:
+    """estimate_opponent_hand_probabilities 的缓存实现 (对手手牌数 > 0)，返回不可变的 (实体名, 概率) 元组"""
+    remaining_deck = Counter(dict(deck_key))
+    remaining_deck.subtract(known_key) # 牌堆中没有的实体已在调用方过滤
+    remaining_deck = +remaining_deck # 只保留正计数，等价于逐张递减并在 0 处截断
     total_remaining_cards = sum(remaining_deck.values())
-    probabilities = defaultdict(float)
-
-    if total_remaining_cards <= 0 or opponent_hand_size <= 0:
-        return dict(probabilities)
 
-    for entity_name, count in remaining_deck.items():
-        if count > 0:
-            proportion = count / total_remaining_cards
-            probabilities[entity_name] = proportion
+    if total_remaining_cards <= 0:
+        return ()
 
-    return dict(probabilities)
+    return tuple((entity_name, count / total_remaining_cards)
+                 for entity_name, count in remaining_deck.items())
 
 
 # --- Weight Calculation (Keep as is) ---
-def calculate_weights(player_hp_ratio: float, opponent_hp_ratio: float) -> Dict[str, float]:
-    """根据双方血量计算属性权重"""
+def calculate_weights(player_hp_ratio: float, opponent_hp_ratio: float) -> Tuple[float, float, float]:
+    """根据双方血量计算属性权重，返回 (attack, defense, support) 元组 (顺序与 BASE_ATTRS_ARRAY 的列一致)"""
     attack_weight = 1.0 + (1.0 - opponent_hp_ratio) # 敌方血少，攻击权重高
     defense_weight = 1.0 + (1.0 - player_hp_ratio)   # 己方血少，防御权重高
     support_weight = 1.0 # 辅助权重暂时固定
-    return {"attack": attack_weight, "defense": defense_weight, "support": support_weight}
+    return (attack_weight, defense_weight, support_weight)
 
-# --- Action Evaluation (Handles TensorAttributeSet from learned weights) ---
+# --- Action Evaluation (plain floats only; the differentiable version lives in training.evaluate_action_tensor) ---
 def evaluate_action(
     action: ActionEntity,
-    weights: Dict[str, float],
-    # Modifier might be TensorAttributeSet during runtime if derived from learned weights
-    active_influence_modifier: Union[AttributeSet, TensorAttributeSet] = TensorAttributeSet(), # Default to empty Tensor set
+    weights: Tuple[float, float, float], # calculate_weights 的 (attack, defense, support)
+    # 修正值在进入推理时已转换为 AttributeSet 或 (attack, defense, support) 数组，这里不再接触张量
+    active_influence_modifier: Optional[Union[AttributeSet, np.ndarray]] = None,
     chosen_scope: Optional[int] = None # Keep chosen_scope, though not directly used in this func
 ) -> float:
     """
-    评估单个行动的价值。
-    如果 active_influence_modifier 是 TensorAttributeSet，则从中提取数值。
+    评估单个行动的价值 (纯浮点运算，不做张量 -> Python 的同步转换)。
+    需要梯度时 (训练) 使用 training.evaluate_action_tensor。
     """
-    # Base attributes are always floats (AttributeSet)
-    base_attrs = action.base_attributes
-
-    # Add base attributes and the modifier. This works if modifier is AttributeSet or TensorAttributeSet
-    # The result will be AttributeSet or TensorAttributeSet
-    effective_attributes = base_attrs + active_influence_modifier
-
-    # Extract float values for score calculation
-    if isinstance(effective_attributes, TensorAttributeSet):
-        # Detach tensor from graph and get Python float value
-        atk = effective_attributes.attack.detach().item()
-        dfs = effective_attributes.defense.detach().item()
-        sup = effective_attributes.support.detach().item()
-    elif isinstance(effective_attributes, AttributeSet):
-         atk = effective_attributes.attack
-         dfs = effective_attributes.defense
-         sup = effective_attributes.support
-    else:
-        # Fallback, should not happen with current __add__ implementations
-        atk, dfs, sup = 0.0, 0.0, 0.0
-        print(f"Warning: Unexpected type for effective_attributes in evaluate_action: {type(effective_attributes)}")
-
-    # Calculate score using float values
-    score = (atk * weights.get("attack", 1.0) +
-             dfs * weights.get("defense", 1.0) +
-             sup * weights.get("support", 1.0))
+    atk, dfs, sup = ge.BASE_ATTRS_ARRAY[action.base_attrs_idx].tolist()
+    if isinstance(active_influence_modifier, AttributeSet):
+        atk += active_influence_modifier.attack
+        dfs += active_influence_modifier.defense
+        sup += active_influence_modifier.support
+    elif active_influence_modifier is not None:
+        # ndarray.tolist() 直接产出 Python float (float32 也精确转换)，不必先复制为 float64 数组；
+        # 长度为 3 的向量用标量运算比 (base + modifier) @ weights 的 numpy 调用更快
+        if isinstance(active_influence_modifier, np.ndarray):
+            mod_atk, mod_dfs, mod_sup = active_influence_modifier.tolist()
+        else:
+            mod_atk, mod_dfs, mod_sup = active_influence_modifier
+        atk += mod_atk
+        dfs += mod_dfs
+        sup += mod_sup
 
-    return score
+    attack_w, defense_w, support_w = weights
+    return atk * attack_w + dfs * defense_w + sup * support_w
 
 # --- Best Sequence Finder (Uses LEARNED weights) ---
-def find_best_sequence(
-    player: Player,
-    opponent: Player
-) -> Tuple[List[Tuple[ActionEntity, Optional[int]]], float]:
-    """
-    查找当前玩家的最佳行动顺序，使用从全局 ge.influence_weights 获取的影响修正值。
-    """
-    # Check if weights are loaded/initialized. This should be handled by main.py ideally.
-    if ge.influence_weights is None:
-        print("Warning: ge.influence_weights is None in find_best_sequence. Influence modifiers will be zero.")
-        # As a safety measure, maybe initialize here? Or rely on main.py's init.
-        # For now, proceed assuming zero influence if not loaded.
+from scoring_kernel import (HAVE_NUMBA, SCORE_EPS, BATCH_MAX_CHOICES, UNROLL_MAX_CHOICES, search_best_sequence,
+                            score_all_orderings, unrolled_search)
+
+# find_best_sequence 的搜索结果缓存 (LRU): 内核输入字节 -> (最佳序列的选择下标, 得分)
+_BEST_SEQ_CACHE_SIZE = 4096
+_BEST_SEQ_CACHE: "OrderedDict[Tuple, Tuple[List[int], float]]" = OrderedDict()
 
-    context_weights = calculate_weights(player.hero.get_hp_ratio(), opponent.hero.get_hp_ratio())
+# 跨调用的置换表 (LRU): 在任何预处理之前按 (手牌哈希, 双方血量比例, beam_width, 权重身份与版本) 命中，
+# 直接返回上次的最佳序列。血量比例按原值参与键 (不分桶取整)，命中结果与重新搜索完全一致。
+# 值中保留整手牌的原型和权重对象的引用，保证键里用到的 id 在条目存在期间不会被复用。
+_TRANSPOSITION_TABLE_SIZE = 100_000
+_TRANSPOSITION_TABLE: "OrderedDict[Tuple, Tuple[Tuple[Tuple[ActionEntity, Optional[int]], ...], float, Tuple[Any, ...]]]" = OrderedDict()
+# Zobrist 随机数: (手牌位置, 原型 id) -> 64 位随机数，按需生成
+_ZOBRIST: Dict[Tuple[int, int], int] = {}
+_ZOBRIST_RNG = random.Random(42)
 
+def _hand_hash(hand_ids: Tuple[int, ...]) -> int:
+    """手牌的 Zobrist 哈希: 各位置 (位置, 原型 id) 随机数的异或。
+    包含位置信息 (而不只是多重集)，因为同分序列的取舍依赖手牌顺序。"""
+    h = 0
+    for key in enumerate(hand_ids):
+        z = _ZOBRIST.get(key)
+        if z is None:
+            z = _ZOBRIST[key] = _ZOBRIST_RNG.getrandbits(64)
+        h ^= z
+    return h
+
+def _build_hand_plan(hand: List[ActionEntity]) -> Tuple:
+    """
+    与权重/血量无关的手牌预处理 (只依赖手牌本身)，结果缓存在 Player._choices_cache 中：
+    (行动选择列表, 基础属性矩阵, 名称编号数组, dup_prev, 名称数, CSR rule_indptr, rule_targets, 修正值查询键列表, rule_rows)
+    """
     # 1. Generate all possible "action choices" (entity, chosen_scope) from hand
     possible_action_choices: List[Tuple[ActionEntity, Optional[int]]] = []
-    for entity in player.hand:
+    for entity in hand:
         if entity.scope:
             # If scopable, create choices for each scope option
             for scope_option in entity.scope:
@@ -125,65 +154,173 @@ def find_best_sequence(
             # If not scopable, the only choice is the entity itself with None scope
             possible_action_choices.append((entity, None))
 
-    best_sequence_choices: List[Tuple[ActionEntity, Optional[int]]] = []
-    max_score = -float('inf')
-
-    # 2. Iterate through permutations of possible action choices
-    # Consider permutations up to the number of choices available
-    max_k = len(possible_action_choices)
-    for k in range(max_k + 1): # Check sequences of length 0 to max_k
-        # Use itertools.permutations to get sequences of length k
-        for sequence_tuple in itertools.permutations(possible_action_choices, k):
-            current_sequence_choices = list(sequence_tuple)
-            current_total_score = 0.0
-            # Use TensorAttributeSet to accumulate modifiers, even if weights aren't loaded (defaults to 0 tensor)
-            influences_in_sequence: Dict[int, TensorAttributeSet] = defaultdict(TensorAttributeSet)
-
-            # --- First pass: Calculate influence using LEARNED weights ---
-            if ge.influence_weights is not None: # Only calculate if weights are available
-                for i, (action_i, chosen_scope_i) in enumerate(current_sequence_choices):
-                    # Check potential influences defined for action_i in prototypes
-                    for target_entity_name, possible_scopes in action_i.potential_influences.items():
-                         # Check each scope rule defined for this source-target pair
-                         for required_scope in possible_scopes:
-                              # Does the rule's required scope match the scope chosen for action_i?
-                              if required_scope is None or required_scope == chosen_scope_i:
-                                  # --- Get modifier tensor from LEARNED WEIGHTS ---
-                                  modifier_tensor = get_influence_modifier_tensor(
-                                      action_i.name, target_entity_name, required_scope
-                                  )
-                                  # --- End of learned weight usage ---
-
-                                  if modifier_tensor is not None:
-                                      # Find the first subsequent action matching the target name
-                                      for j in range(i + 1, len(current_sequence_choices)):
-                                          action_j, _ = current_sequence_choices[j]
-                                          if action_j.name == target_entity_name:
-                                              # Accumulate the tensor modifier
-                                              influences_in_sequence[j] += modifier_tensor
-                                              # Assumption: influence applies only to the first match
-                                              break # Move to the next rule/target
-
-            # --- Second pass: Evaluate sequence score using accumulated modifiers ---
-            for i, (action, chosen_scope) in enumerate(current_sequence_choices):
-                # Get the accumulated modifier (TensorAttributeSet, possibly all zeros)
-                modifier_for_this_action = influences_in_sequence[i]
-                # evaluate_action handles TensorAttributeSet modifier and returns float score
-                action_score = evaluate_action(action, context_weights, modifier_for_this_action, chosen_scope)
-                current_total_score += action_score
-
-            # Update best sequence found so far
-            if current_total_score > max_score:
-                max_score = current_total_score
-                best_sequence_choices = current_sequence_choices
-
-    return best_sequence_choices, max_score
-
-# --- Remove prototype loading from here; it's handled in main.py ---
-# try:
-#     print("Game Logic: Loading entity data for prototypes...")
-#     import database # Local import for this block if needed, avoid top-level if circular
-#     all_entity_data = database.load_entities_from_db()
-#     ge.load_action_entity_prototypes(all_entity_data)
-# except Exception as e:
-#     print(f"Game Logic Error: Failed to load entity data on import: {e}")
+    entity_ids = [action.base_attrs_idx for action, _ in possible_action_choices]
+    name_to_id: Dict[str, int] = {}
+    name_ids = [name_to_id.setdefault(action.name, len(name_to_id)) for action, _ in possible_action_choices]
+    # 同一原型、同一作用域的重复选择 (如多张"杀") 可以互换，记录前一个相同选择的下标
+    previous_same: Dict[Tuple[int, Optional[int]], int] = {}
+    dup_prev = [-1] * len(possible_action_choices)
+    for i, (action, chosen_scope) in enumerate(possible_action_choices):
+        key = (action.base_attrs_idx, chosen_scope)
+        dup_prev[i] = previous_same.get(key, -1)
+        previous_same[key] = i
+    # 手牌中出现的实体 id -> (名称编号, 名称)；目标不在手牌中的影响不会生效
+    hand_targets = {entity_id: (name_id, action.name)
+                    for entity_id, name_id, (action, _) in zip(entity_ids, name_ids, possible_action_choices)}
+
+    # 2. 收集所有可能生效的影响 (来源选择, 目标名称编号, 修正值查询键的行号)
+    rule_sources: List[int] = []
+    rule_targets: List[int] = []
+    rule_rows: List[int] = []
+    # (来源 id, 目标 id, 作用域) -> modifier_keys 中的行号；同名手牌/同一影响的多个作用域只查询一次修正值
+    modifier_rows: Dict[Tuple[int, int, int], int] = {}
+    modifier_keys: List[Tuple[str, str, Optional[int]]] = []
+    # 循环中反复用到的全局量与方法提到局部变量；同一 (原型, 作用域) 的生效影响只筛选一次 (如多张"杀")
+    no_scope = ge.NO_SCOPE
+    hand_targets_get = hand_targets.get
+    modifier_rows_get = modifier_rows.get
+    active_influences: Dict[Tuple[int, Optional[int]], List[Tuple[int, int]]] = {}
+    for i, (action_i, chosen_scope_i) in enumerate(possible_action_choices):
+        source_idx = entity_ids[i]
+        influences = active_influences.get((source_idx, chosen_scope_i))
+        if influences is None:
+            # 使用原型上预计算的影响数组: 规则所需作用域为 None (NO_SCOPE) 或与所选作用域一致时生效
+            required_scopes = action_i.influence_required_scope
+            scope_code = no_scope if chosen_scope_i is None else chosen_scope_i
+            active = (required_scopes == no_scope) | (required_scopes == scope_code)
+            influences = active_influences[(source_idx, chosen_scope_i)] = list(
+                zip(action_i.influence_target_idx[active].tolist(), required_scopes[active].tolist()))
+        for target_idx, required_scope in influences:
+            target = hand_targets_get(target_idx)
+            if target is None:
+                continue
+            target_id, target_entity_name = target
+            key = (source_idx, target_idx, required_scope)
+            row = modifier_rows_get(key)
+            if row is None:
+                row = modifier_rows[key] = len(modifier_keys)
+                modifier_keys.append((action_i.name, target_entity_name,
+                                      None if required_scope == no_scope else required_scope))
+            rule_sources.append(i)
+            rule_targets.append(target_id)
+            rule_rows.append(row)
+
+    # 影响按来源选择组织为 CSR (收集时 i 单调递增，已按来源排序)
+    num_choices = len(possible_action_choices)
+    rule_indptr = np.zeros(num_choices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.asarray(rule_sources, dtype=np.int64), minlength=num_choices), out=rule_indptr[1:])
+    # 各选择的 (attack, defense, support) 基础属性行，按手牌缓存；每次调用只需与权重向量相乘
+    base_attrs = ge.BASE_ATTRS_ARRAY[entity_ids]
+    base_attrs.flags.writeable = False
+    return (possible_action_choices, base_attrs, np.asarray(name_ids, dtype=np.int64),
+            np.asarray(dup_prev, dtype=np.int64), len(name_to_id), rule_indptr, np.asarray(rule_targets, dtype=np.int64), modifier_keys,
+            np.asarray(rule_rows, dtype=np.int64))
+
+def find_best_sequence(
+    player: Player,
+    opponent: Player,
+    beam_width: Optional[int] = None,
+    modifier_fn: Optional[Callable[[List[Tuple[str, str, Optional[int]]]], Tuple[List[int], np.ndarray]]] = None
+) -> Tuple[List[Tuple[ActionEntity, Optional[int]]], float]:
+    """
+    查找当前玩家的最佳行动顺序，使用从全局 ge.influence_weights 获取的影响修正值。
+    默认为精确的分支定界搜索；指定 beam_width 时改为近似的束搜索。
+    modifier_fn: 批量查询修正值的函数，签名同 training.get_influence_modifier_matrix (默认即该函数)；
+    可以注入直接返回 numpy 数组的实现，不依赖 torch 与全局权重。
+    """
+    ensure_prototypes_loaded()
+    if not player.hand:
+        return [], 0.0 # 没有手牌: 只有空序列 (得分 0)，不必查询权重或建立缓存
+    use_modifiers = True
+    injected_modifiers = modifier_fn is not None
+    if modifier_fn is None:
+        from training import get_influence_modifier_matrix as modifier_fn # 延迟导入，避免循环导入
+        # Check if weights are loaded/initialized. This should be handled by main.py ideally.
+        if ge.influence_weights is None:
+            print("Warning: ge.influence_weights is None in find_best_sequence. Influence modifiers will be zero.")
+            # As a safety measure, maybe initialize here? Or rely on main.py's init.
+            # For now, proceed assuming zero influence if not loaded.
+            use_modifiers = False
+
+    player_hp_ratio = player.hero.get_hp_ratio()
+    opponent_hp_ratio = opponent.hero.get_hp_ratio()
+    # Player 与手牌都不可变: 手牌哈希与预处理结果在玩家对象上各算一次 (见 Player._choices_cache)。
+    # 手牌只按原型 id 参与哈希: 原型不可变 (作用域等都由 id 决定)，一次 map(id) 在 C 层完成
+    cache = player._choices_cache
+    if cache is None:
+        cache = (_hand_hash(tuple(map(id, player.hand))), None)
+        object.__setattr__(player, '_choices_cache', cache)
+    tt_key = None
+    if not injected_modifiers: # 注入的 modifier_fn 无法判断是否变化，不走置换表
+        weights = ge.influence_weights
+        # 参数每次被原地修改 (optimizer.step、load_state_dict 等) 时 _version 都会增加，旧条目随之失效
+        weights_version = None if weights is None else tuple(p._version for p in weights.parameters())
+        tt_key = (cache[0], player_hp_ratio, opponent_hp_ratio, beam_width or 0,
+                  id(weights), weights_version)
+        entry = _TRANSPOSITION_TABLE.get(tt_key)
+        if entry is not None:
+            _TRANSPOSITION_TABLE.move_to_end(tt_key)
+            return list(entry[0]), entry[1]
+
+    context_weights = calculate_weights(player_hp_ratio, opponent_hp_ratio)
+
+    # 1-2. 手牌预处理缓存在玩家对象上，置换表未命中时才构建: 同一玩家反复评估时直接复用
+    if cache[1] is None:
+        cache = (cache[0], _build_hand_plan(player.hand))
+        object.__setattr__(player, '_choices_cache', cache)
+    (possible_action_choices, base_attrs, name_ids, dup_prev, num_names,
+     rule_indptr, rule_targets, modifier_keys, rule_rows) = cache[1]
+
+    # 基础得分: 手牌预处理时已按 base_attrs_idx 从 ge.BASE_ATTRS_ARRAY 取出属性行 (n, 3)，
+    # 这里一次矩阵乘法完成 (与 evaluate_action 无修正时相同)；保持 float64，与数据库中的值一致
+    weight_vector = np.array(context_weights)
+    base_scores = base_attrs @ weight_vector
+
+    if len(possible_action_choices) == 1:
+        # 只有一个动作选择: 影响只作用于之后的动作，不会生效；得分为正就执行，否则空序列更优 (同分取更短)
+        score = float(base_scores[0])
+        return (list(possible_action_choices), score) if score > SCORE_EPS else ([], 0.0)
+
+    # 修正值来自可训练的权重，每次调用重新读取；没有对应学习权重的影响记为 0 (等价于不生效)
+    rule_gains = np.zeros(len(rule_rows))
+    if use_modifiers and modifier_keys: # Only calculate if weights are available
+        # 推理只需要修正值本身: 一次批量读取为 float32 数组，不构造 TensorAttributeSet、不记录梯度
+        found_rows, modifier_values = modifier_fn(modifier_keys)
+        if found_rows:
+            # (修正值数, 3) 矩阵与权重向量一次相乘，再按行号取出每条影响的得分
+            modifier_matrix = np.zeros((len(modifier_keys), 3), dtype=np.float32)
+            modifier_matrix[found_rows] = modifier_values
+            rule_gains = (modifier_matrix @ weight_vector)[rule_rows]
+
+    # 3. Branch-and-bound (or beam) search over orderings
+    # 搜索结果只取决于内核输入，按输入数组的精确字节缓存 (同一局面反复评估时直接命中，不做取整，结果与重新搜索完全一致)
+    search_key = (base_scores.tobytes(), rule_gains.tobytes(), name_ids.tobytes(), dup_prev.tobytes(),
+                  rule_indptr.tobytes(), rule_targets.tobytes(), num_names, beam_width or 0)
+    cached = _BEST_SEQ_CACHE.get(search_key)
+    if cached is not None:
+        _BEST_SEQ_CACHE.move_to_end(search_key)
+        best_indices, max_score = cached
+    else:
+        if not HAVE_NUMBA and not beam_width and len(possible_action_choices) <= UNROLL_MAX_CHOICES:
+            best_order, best_len, max_score = unrolled_search(
+                base_scores, name_ids, dup_prev, rule_indptr, rule_targets, rule_gains, num_names
+            )
+        elif not HAVE_NUMBA and not beam_width and len(possible_action_choices) <= BATCH_MAX_CHOICES:
+            best_order, best_len, max_score = score_all_orderings(
+                base_scores, name_ids, rule_indptr, rule_targets, rule_gains, num_names
+            )
+        else:
+            best_order, best_len, max_score = search_best_sequence(
+                base_scores, name_ids, dup_prev, rule_indptr, rule_targets, rule_gains, num_names, beam_width or 0
+            )
+        best_indices = best_order[:best_len].tolist()
+        _BEST_SEQ_CACHE[search_key] = (best_indices, max_score)
+        if len(_BEST_SEQ_CACHE) > _BEST_SEQ_CACHE_SIZE:
+            _BEST_SEQ_CACHE.popitem(last=False) # 淘汰最久未使用的结果
+    best_sequence_choices = [possible_action_choices[i] for i in best_indices]
+    if tt_key is not None:
+        _TRANSPOSITION_TABLE[tt_key] = (tuple(best_sequence_choices), float(max_score),
+                                        (tuple(player.hand), ge.influence_weights))
+        if len(_TRANSPOSITION_TABLE) > _TRANSPOSITION_TABLE_SIZE:
+            _TRANSPOSITION_TABLE.popitem(last=False)
+    return best_sequence_choices, float(max_score)
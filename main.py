@@ -1,17 +1,23 @@
 import argparse
+import logging
+import sys
 import database
 import game_elements as ge # Use ge prefix
-from game_logic import find_best_sequence, estimate_opponent_hand_probabilities # Removed INITIAL_DECK_COMPOSITION import if not used directly here
+from game_logic import find_best_sequence, estimate_opponent_hand_probabilities, ensure_prototypes_loaded # Removed INITIAL_DECK_COMPOSITION import if not used directly here
 # Import necessary functions from training.py
 from training import training_loop, load_weights, save_weights # Removed initialize_influence_weights if only load_weights is used externally
 
+# 状态输出走 logging: run 模式为 INFO (输出与原来的 print 相同)，train 模式只保留 WARNING 及以上，
+# 参数按 %-格式延迟到真正输出时才格式化
+log = logging.getLogger(__name__)
+
 def initialize_system():
     """Initializes database, loads entity prototypes, and prepares weights."""
-    print("--- System Initialization ---")
+    log.info("--- System Initialization ---")
     db_initialized = False
     try:
         # 1. Check Database and Load Base Data
-        print("Checking database and loading base data...")
+        log.info("Checking database and loading base data...")
         all_entity_data = database.load_entities_from_db()
         hero_template = database.load_hero_template('白板1') # Test load a hero
 
@@ -19,69 +25,70 @@ def initialize_system():
         if not all_entity_data or not hero_template:
              # If DB exists but data is missing, maybe repopulate? Or raise error.
              if database.os.path.exists(database.DB_PATH):
-                 print("Database file exists but seems empty or incomplete.")
+                 log.warning("Database file exists but seems empty or incomplete.")
                  raise ValueError("Database missing required entities/heroes.")
              else:
-                 print("Database file not found.")
+                 log.warning("Database file not found.")
                  raise FileNotFoundError("Database file missing.")
-        print("Database appears valid and contains data.")
+        log.info("Database appears valid and contains data.")
         db_initialized = True
 
     except (FileNotFoundError, ValueError, database.sqlite3.OperationalError) as e:
-        print(f"Database check/load failed ({e}). Attempting to initialize/repopulate...")
+        log.warning("Database check/load failed (%s). Attempting to initialize/repopulate...", e)
         # If DB file might be corrupt or outdated, removing it first can be safer
         if database.os.path.exists(database.DB_PATH):
-            print(f"Removing existing database file: {database.DB_PATH}")
+            log.info("Removing existing database file: %s", database.DB_PATH)
+            database.close_db_connection() # Release the shared connection before deleting the file
             try:
                 database.os.remove(database.DB_PATH)
             except OSError as rm_err:
-                 print(f"Warning: Could not remove old DB file: {rm_err}. Proceeding anyway.")
+                 log.warning("Warning: Could not remove old DB file: %s. Proceeding anyway.", rm_err)
 
         try:
             database.initialize_database()
             database.populate_initial_data()
             db_initialized = True
-            print("Database initialized and populated successfully.")
+            log.info("Database initialized and populated successfully.")
             # Reload data after initializing
             all_entity_data = database.load_entities_from_db()
             if not all_entity_data: # Check again after init
                  raise RuntimeError("Failed to load entity data even after initialization.")
         except Exception as init_e:
-            print(f"FATAL: Database initialization failed: {init_e}")
+            log.critical("FATAL: Database initialization failed: %s", init_e)
             return False # Indicate failure
 
     # 2. Load Prototypes into Game Elements (only if DB init/load succeeded)
     if db_initialized and all_entity_data:
-        print("Loading entity prototypes...")
-        ge.load_action_entity_prototypes(all_entity_data)
+        log.info("Loading entity prototypes...")
+        ensure_prototypes_loaded() # Loads from the (cached) database data once per process
         if not ge.ACTION_ENTITY_PROTOTYPES:
-             print("FATAL: Failed to load prototypes into game elements.")
+             log.critical("FATAL: Failed to load prototypes into game elements.")
              return False # Indicate failure
-        print("Entity prototypes loaded.")
+        log.info("Entity prototypes loaded.")
     else:
-        print("FATAL: Cannot load prototypes because database initialization/loading failed.")
+        log.critical("FATAL: Cannot load prototypes because database initialization/loading failed.")
         return False # Indicate failure
 
     # 3. Load or Initialize Weights (depends on prototypes being loaded)
-    print("Loading/Initializing influence weights...")
+    log.info("Loading/Initializing influence weights...")
     # load_weights now handles initialization if file not found/error
     # It requires prototypes to be loaded first to know the structure
     load_weights(ge.ACTION_ENTITY_PROTOTYPES)
     if ge.influence_weights is None:
-        print("FATAL: Failed to load or initialize influence weights.")
+        log.critical("FATAL: Failed to load or initialize influence weights.")
         return False # Indicate failure
-    print("Influence weights ready.")
+    log.info("Influence weights ready.")
 
-    print("--- System Initialization Complete ---")
+    log.info("--- System Initialization Complete ---")
     return True # Indicate success
 
 def run_test_scenario():
     """Runs the simple 1v1 test scenario using loaded/initialized weights."""
-    print("\n--- Running Test Scenario ---")
+    log.info("\n--- Running Test Scenario ---")
 
     # Weights should have been loaded by initialize_system()
     if ge.influence_weights is None:
-        print("CRITICAL ERROR: Influence weights not available for test scenario. Aborting.")
+        log.critical("CRITICAL ERROR: Influence weights not available for test scenario. Aborting.")
         # Attempting to load again might be redundant if initialize_system failed
         return
 
@@ -99,7 +106,7 @@ def run_test_scenario():
             try:
                 my_hand_entities.append(ge.get_action_entity_instance(name))
             except ValueError as e:
-                print(f"Warning: Could not get instance for '{name}': {e}. Skipping card.")
+                log.warning("Warning: Could not get instance for '%s': %s. Skipping card.", name, e)
 
         me = ge.Player(name="玩家1", hero=my_hero, hand=my_hand_entities)
 
@@ -108,21 +115,22 @@ def run_test_scenario():
         opponent_hand_count = 3 # Example value
 
     except Exception as setup_e:
-        print(f"Error setting up scenario: {setup_e}")
+        log.error("Error setting up scenario: %s", setup_e)
         return
 
-    print("\n--- Scenario Info ---")
-    print(f"己方: {me.name} ({me.hero.name} {me.hero.current_hp}/{me.hero.max_hp} HP)")
-    print(f"  手牌: {[entity.name for entity in me.hand]}")
-    print(f"敌方: {opponent.name} ({opponent.hero.name} {opponent.hero.current_hp}/{opponent.hero.max_hp} HP)")
-    print(f"  手牌数: {opponent_hand_count}")
-    print("-" * 20)
+    if log.isEnabledFor(logging.INFO): # 下面的 f-string 只在会输出时才求值
+        log.info("\n--- Scenario Info ---")
+        log.info(f"己方: {me.name} ({me.hero.name} {me.hero.current_hp}/{me.hero.max_hp} HP)")
+        log.info(f"  手牌: {[entity.name for entity in me.hand]}")
+        log.info(f"敌方: {opponent.name} ({opponent.hero.name} {opponent.hero.current_hp}/{opponent.hero.max_hp} HP)")
+        log.info(f"  手牌数: {opponent_hand_count}")
+        log.info("-" * 20)
 
     # --- Calculate Best Sequence (Uses loaded learned weights via game_logic) ---
     try:
         best_sequence_choices, best_score = find_best_sequence(me, opponent)
     except Exception as calc_e:
-        print(f"Error calculating best sequence: {calc_e}")
+        log.error("Error calculating best sequence: %s", calc_e)
         return
 
     # --- Calculate Opponent Hand Probabilities (Unchanged logic) ---
@@ -130,28 +138,29 @@ def run_test_scenario():
     opponent_probs = estimate_opponent_hand_probabilities(known_entities, opponent_hand_count)
 
     # --- Output ---
-    print("--- Recommended Action Sequence (Based on Current Weights) ---")
+    if not log.isEnabledFor(logging.INFO):
+        return # 不输出时不做任何格式化
+    log.info("--- Recommended Action Sequence (Based on Current Weights) ---")
     if best_sequence_choices:
         # More detailed representation showing entity and chosen scope
         sequence_repr = []
         for entity, scope in best_sequence_choices:
             scope_str = f"(作用域:{scope})" if scope is not None else ""
             sequence_repr.append(f"{entity.name}{scope_str}")
-        print(f"Sequence: {' -> '.join(sequence_repr)}")
-        print(f"Expected Score: {best_score:.4f}") # Show more precision
+        log.info("Sequence: %s", ' -> '.join(sequence_repr))
+        log.info("Expected Score: %.4f", best_score) # Show more precision
     else:
-        print("No recommended actions.")
-    print("-" * 20)
+        log.info("No recommended actions.")
+    log.info("-" * 20)
 
-    print("--- Opponent Hand Probability Estimate ---")
+    log.info("--- Opponent Hand Probability Estimate ---")
     if opponent_probs:
         sorted_probs = sorted(opponent_probs.items(), key=lambda item: item[1], reverse=True)
         for entity_name, prob in sorted_probs:
-            print(f"  {entity_name}: {prob:.2%}")
+            log.info("  %s: %.2f%%", entity_name, prob * 100)
     else:
-        print("Cannot estimate probabilities (check deck/opponent hand size).")
-    print("-" * 38)
-
+        log.info("Cannot estimate probabilities (check deck/opponent hand size).")
+    log.info("-" * 38)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="SGS AI - Train influence weights or Run test scenario.")
@@ -160,8 +169,13 @@ if __name__ == "__main__":
     parser.add_argument('--lr', type=float, default=0.01, help="Learning rate (if mode is train).")
     parser.add_argument('--batch_size', type=int, default=16, help="Batch size for training.")
     parser.add_argument('--dummy_samples', type=int, default=200, help="Number of dummy samples to generate for training.")
+    parser.add_argument('--grad_accum_steps', type=int, default=1, help="Batches to accumulate gradients over before each optimizer step.")
+    parser.add_argument('--device', type=str, default=None, help="Device to train on (e.g. 'cpu', 'cuda'); defaults to CUDA when available.")
 
     args = parser.parse_args()
+    # 训练时跳过逐条状态输出 (只保留警告与错误)；输出到 stdout，与 print 一致
+    logging.basicConfig(stream=sys.stdout, format="%(message)s",
+                        level=logging.WARNING if args.mode == 'train' else logging.INFO)
 
     # --- Perform Initialization Once ---
     if not initialize_system():
@@ -182,7 +196,9 @@ if __name__ == "__main__":
             num_epochs=args.epochs,
             learning_rate=args.lr,
             batch_size=args.batch_size,
-            num_dummy_samples=args.dummy_samples
+            num_dummy_samples=args.dummy_samples,
+            gradient_accumulation_steps=args.grad_accum_steps,
+            device=args.device
         )
         print("Training finished. Weights saved to influence_weights.pth (if successful).")
 
@@ -0,0 +1,412 @@
+# 序列搜索的数值内核: 只接受 numpy 数组与标量，与游戏对象无关。
+# 安装了可选依赖 numba 时编译为本地代码 (cache=True，编译结果缓存在 __pycache__ 中)，
+# 模块加载时用极小的输入预热一次，把编译/加载缓存的开销挪出第一次真正的搜索。
+from functools import lru_cache
+import itertools
+import numpy as np
+
+try:
+    from numba import njit # 可选依赖: 搜索内核编译为本地代码
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    def njit(*args, **kwargs):
+        """未安装 numba 时的替身装饰器，内核以普通 Python 函数运行 (结果相同，只是更慢)"""
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# 浮点比较容差: 上界与得分由不同顺序的加法得到，相等时不应因舍入误差被误剪枝
+SCORE_EPS = 1e-9
+
+@njit(cache=True)
+def search_best_sequence(base_scores, name_ids, dup_prev, rule_indptr, rule_targets, rule_gains, num_names, beam_width):
+    """
+    分支定界 DFS，在"动作选择"的所有有序子序列 (含空序列) 中找总分最高者，得分相同时取更短的序列。
+    选择 i 生效的影响按 CSR 存放在 [rule_indptr[i], rule_indptr[i+1]) 中 (目标名称编号, 影响得分)，
+    作用于其后第一个同名的动作。分数对属性是线性的，所以影响可以预先折算为标量；
+    搜索中只维护每个名称上待生效的影响得分。
+    上界 = 当前得分 + 剩余选择的正基础分 + 剩余选择与待生效影响中的正影响分，无法超过最优 (或贪心序列得分) 时剪枝；
+    先用 O(1) 增量维护的粗上界，通不过再算只计入仍有同名动作可接收的影响的紧上界。
+    不同顺序到达同一状态 (已用选择集合 + 待生效影响集合) 时只保留前缀得分最高的一条 (置换表)。
+    dup_prev[i] 为与选择 i 完全相同 (同一原型、同一作用域) 的前一个选择下标 (没有则为 -1)；
+    相同的选择只按下标顺序使用，每个多重集排列只搜索一次 (结果就是原本字典序最先的那个)。
+    beam_width > 0 时每层只展开即时得分最高的 beam_width 个子节点 (近似搜索)。
+    只使用 numpy 数组与标量，可由 numba 编译；用显式栈代替递归，每层的状态保存在预分配的数组中，
+    展开节点时只在这些缓冲区上原地交换下标，搜索循环内不产生任何分配。
+    返回 (best_order, best_len, best_score)，最佳序列为 best_order[:best_len]。
+    """
+    n = base_scores.shape[0]
+    rule_gain = np.zeros(n)
+    for i in range(n):
+        for e in range(rule_indptr[i], rule_indptr[i + 1]):
+            if rule_gains[e] > 0.0:
+                rule_gain[i] += rule_gains[e]
+    optimistic = np.maximum(base_scores, 0.0) + rule_gain
+
+    # 被支配的选择不参与搜索: 基础分 <= 0、发出的影响都 <= 0、且没有正影响以它的名称为目标。
+    # 把它从任意序列中删去，它吸收的待生效影响 (<= 0) 会转给下一张同名动作或直接作废，
+    # 总分不会降低且序列更短，所以最优序列中不会出现它 (等价于"边际得分为负就不再延伸"的精确版本)。
+    positive_target = np.zeros(num_names, dtype=np.bool_)
+    for e in range(rule_targets.shape[0]):
+        if rule_gains[e] > 0.0:
+            positive_target[rule_targets[e]] = True
+    used = np.zeros(n, dtype=np.bool_)
+    n_active = n
+    for i in range(n):
+        if base_scores[i] <= 0.0 and rule_gain[i] == 0.0 and not positive_target[name_ids[i]]:
+            used[i] = True
+            n_active -= 1
+
+    # 当前路径上每个名称待生效的影响得分及其正值部分之和 (用于上界)：整个搜索只用这一份缓冲区，
+    # 进入子节点时原地修改，并把被改写的旧值压入撤销日志，回溯时按逆序原样恢复 (不做减法，没有舍入漂移)
+    pending = np.zeros(num_names)
+    pending_gain = np.zeros(num_names)
+    log_size = n + rule_targets.shape[0]
+    undo_name = np.zeros(log_size, dtype=np.int64)
+    undo_pending = np.zeros(log_size)
+    undo_gain = np.zeros(log_size)
+    undo_start = np.zeros(n + 1, dtype=np.int64) # 第 d 层的修改在日志中的起始位置
+    undo_top = 0
+    # 剪枝下限: 贪心序列 (每步取即时得分最高且为正的选择) 的得分是可达得分，最优解不会低于它。
+    # 它只用于剪掉上界明显低于该值的分支，不作为当前最优解，所以"同分取更短/字典序更前"的规则不受影响。
+    greedy_score = 0.0
+    greedy_used = used.copy()
+    for _ in range(n_active):
+        pick = -1
+        pick_gain = 0.0
+        for i in range(n):
+            if not greedy_used[i]:
+                gain = base_scores[i] + pending[name_ids[i]]
+                if gain > pick_gain:
+                    pick = i
+                    pick_gain = gain
+        if pick < 0:
+            break
+        greedy_used[pick] = True
+        greedy_score += pick_gain
+        pending[name_ids[pick]] = 0.0
+        for e in range(rule_indptr[pick], rule_indptr[pick + 1]):
+            pending[rule_targets[e]] += rule_gains[e]
+    pending[:] = 0.0
+    prune_floor = greedy_score - SCORE_EPS
+
+    # 置换表 (Held-Karp 式的状态合并): 之后的得分只取决于 (已用选择集合, 仍待生效的影响集合)，
+    # 两者各编码为一个 int64 位掩码。同一状态再次到达时，前缀得分不更高就剪掉
+    # (更早到达的前缀字典序更前，同分时本来就优先)。选择或影响超过 62 个时不启用。
+    use_memo = n <= 62 and rule_targets.shape[0] <= 62
+    rules_to_name = np.zeros(num_names, dtype=np.int64) # 以该名称为目标的影响
+    rules_from = np.zeros(n, dtype=np.int64)            # 选择 i 发出的影响
+    if use_memo:
+        for i in range(n):
+            for e in range(rule_indptr[i], rule_indptr[i + 1]):
+                rules_from[i] |= np.int64(1) << e
+                rules_to_name[rule_targets[e]] |= np.int64(1) << e
+    memo = {(np.int64(0), np.int64(0)): 0.0}
+    state_used = np.zeros(n + 1, dtype=np.int64)
+    state_live = np.zeros(n + 1, dtype=np.int64)
+
+    # 每个名称还剩多少个可用 (未使用且未被支配) 的选择
+    name_left = np.zeros(num_names, dtype=np.int64)
+    for i in range(n):
+        if not used[i]:
+            name_left[name_ids[i]] += 1
+
+    # 第 d 层 (已选 d 个动作) 的状态
+    prefix_score = np.zeros(n + 1)
+    remaining_optimistic = np.zeros(n + 1)
+    pending_optimistic = np.zeros(n + 1)
+    children = np.zeros((n + 1, n), dtype=np.int64)
+    child_count = np.zeros(n + 1, dtype=np.int64)
+    cursor = np.zeros(n + 1, dtype=np.int64)
+    child_keys = np.zeros(n)                    # 束搜索排序用的即时得分缓冲区
+    order = np.zeros(n, dtype=np.int64)
+    best_order = np.zeros(n, dtype=np.int64)
+    best_len = 0
+    best_score = 0.0 # 空序列
+
+    remaining_optimistic[0] = optimistic.sum()
+    depth = 0
+    while depth >= 0:
+        if cursor[depth] == 0 and child_count[depth] == 0 and depth < n_active:
+            # 首次进入该层: 列出未使用的选择 (相同的选择中只取下标最小的未使用者)
+            count = 0
+            for i in range(n):
+                if not used[i] and (dup_prev[i] < 0 or used[dup_prev[i]]):
+                    children[depth, count] = i
+                    count += 1
+            if beam_width > 0:
+                # 按即时得分降序原地插入排序 (稳定，同分保持下标顺序)，不分配临时数组
+                for c in range(count):
+                    i = children[depth, c]
+                    key = base_scores[i] + pending[name_ids[i]]
+                    j = c
+                    while j > 0 and child_keys[j - 1] < key:
+                        child_keys[j] = child_keys[j - 1]
+                        children[depth, j] = children[depth, j - 1]
+                        j -= 1
+                    child_keys[j] = key
+                    children[depth, j] = i
+                count = min(count, beam_width)
+            child_count[depth] = count
+
+        if cursor[depth] >= child_count[depth]:
+            # 该层子节点已全部展开，回溯: 撤销进入该层时对待生效影响的修改
+            while undo_top > undo_start[depth]:
+                undo_top -= 1
+                pending[undo_name[undo_top]] = undo_pending[undo_top]
+                pending_gain[undo_name[undo_top]] = undo_gain[undo_top]
+            child_count[depth] = 0
+            cursor[depth] = 0
+            depth -= 1
+            if depth >= 0:
+                used[order[depth]] = False
+                name_left[name_ids[order[depth]]] += 1
+            continue
+
+        i = children[depth, cursor[depth]]
+        cursor[depth] += 1
+        name_id = name_ids[i]
+        consumed = pending[name_id]
+        consumed_gain = pending_gain[name_id]
+        score = prefix_score[depth] + base_scores[i] + consumed
+        order[depth] = i
+        length = depth + 1
+        if score > best_score + SCORE_EPS or (score >= best_score - SCORE_EPS and length < best_len):
+            best_score = score
+            best_len = length
+            best_order[:length] = order[:length]
+
+        if length == n_active:
+            continue
+        next_remaining = remaining_optimistic[depth] - optimistic[i]
+        next_pending = pending_optimistic[depth] - consumed_gain + rule_gain[i]
+        bound = score + next_remaining + next_pending
+        if bound < prune_floor:
+            continue
+        if not (bound > best_score + SCORE_EPS or (bound >= best_score - SCORE_EPS and length + 1 < best_len)):
+            continue
+        # 上面的 O(1) 上界没能剪掉时，再算一个更紧的上界: 只有之后还有同名动作可以接收的正影响才计入
+        # (没有剩余同名动作的目标，其待生效影响和将要发出的影响都不可能再生效)
+        name_left[name_id] -= 1
+        bound = score
+        for j in range(n):
+            if not used[j] and j != i:
+                if base_scores[j] > 0.0:
+                    bound += base_scores[j]
+                for e in range(rule_indptr[j], rule_indptr[j + 1]):
+                    target_id = rule_targets[e]
+                    # 选择 j 先消费再发出影响，所以它自己不能接收自己发出的影响
+                    if rule_gains[e] > 0.0 and name_left[target_id] > (1 if name_ids[j] == target_id else 0):
+                        bound += rule_gains[e]
+        for target_id in range(num_names):
+            if target_id != name_id and name_left[target_id] > 0:
+                bound += pending_gain[target_id]
+        for e in range(rule_indptr[i], rule_indptr[i + 1]):
+            if rule_gains[e] > 0.0 and name_left[rule_targets[e]] > 0:
+                bound += rule_gains[e]
+        name_left[name_id] += 1
+        if bound < prune_floor:
+            continue
+        if not (bound > best_score + SCORE_EPS or (bound >= best_score - SCORE_EPS and length + 1 < best_len)):
+            continue
+        if use_memo:
+            next_used = state_used[depth] | (np.int64(1) << i)
+            next_live = (state_live[depth] & ~rules_to_name[name_id]) | rules_from[i]
+            key = (next_used, next_live)
+            if memo.get(key, -np.inf) >= score - SCORE_EPS:
+                continue
+            memo[key] = score
+            state_used[length] = next_used
+            state_live[length] = next_live
+
+        # 进入下一层: 先消费该名称上的待生效影响，再发出自身的影响 (可作用于之后的同名动作)
+        undo_start[length] = undo_top
+        undo_name[undo_top] = name_id
+        undo_pending[undo_top] = consumed
+        undo_gain[undo_top] = consumed_gain
+        undo_top += 1
+        pending[name_id] = 0.0
+        pending_gain[name_id] = 0.0
+        for e in range(rule_indptr[i], rule_indptr[i + 1]):
+            target_id = rule_targets[e]
+            gain = rule_gains[e]
+            undo_name[undo_top] = target_id
+            undo_pending[undo_top] = pending[target_id]
+            undo_gain[undo_top] = pending_gain[target_id]
+            undo_top += 1
+            pending[target_id] += gain
+            if gain > 0.0:
+                pending_gain[target_id] += gain
+        prefix_score[length] = score
+        remaining_optimistic[length] = next_remaining
+        pending_optimistic[length] = next_pending
+        used[i] = True
+        name_left[name_id] -= 1
+        depth = length
+
+    return best_order, best_len, best_score
+
+# 未安装 numba 时，不超过该数量的有效选择改用一次性向量化枚举全部排列 (7! = 5040 行)，
+# 避免解释执行的 DFS 内核；安装了 numba 时编译后的分支定界更快，不走此路径
+BATCH_MAX_CHOICES = 7
+
+@lru_cache(maxsize=None)
+def _permutations(n: int) -> np.ndarray:
+    """range(n) 的全部排列，按列存放的 (n, n!) int64 数组：第 j 列是字典序第 j 个排列 (与 DFS 的展开顺序一致)。
+    每一行是所有排列在同一位置上的取值，逐位置的向量运算读写的都是连续内存。
+    """
+    perms = np.array(list(itertools.permutations(range(n))), dtype=np.int64).reshape(-1, n)
+    return np.ascontiguousarray(perms.T)
+
+def _active_choices(base_scores, name_ids, rule_indptr, rule_targets, rule_gains) -> np.ndarray:
+    """未被支配的选择下标 (升序)，判定规则与 search_best_sequence 相同"""
+    n = base_scores.shape[0]
+    rule_sources = np.repeat(np.arange(n), np.diff(rule_indptr))
+    positive = rule_gains > 0.0
+    emits_positive = np.bincount(rule_sources[positive], minlength=n) > 0
+    positive_target = np.isin(name_ids, rule_targets[positive])
+    return np.flatnonzero((base_scores > 0.0) | emits_positive | positive_target)
+
+def score_all_orderings(base_scores, name_ids, rule_indptr, rule_targets, rule_gains, num_names):
+    """
+    search_best_sequence 的向量化版本 (无束搜索)，适用于少量选择：
+    有序子序列都是某个全排列的前缀，所以对 (n, n!) 的排列矩阵逐位置计算边际得分，
+    沿位置累加即得到所有前缀的得分，一次 argmax 选出最优。得分相同时取更短、再取字典序最小的序列。
+    返回值与 search_best_sequence 相同。
+    """
+    n = base_scores.shape[0]
+    best_order = np.zeros(n, dtype=np.int64)
+    active = _active_choices(base_scores, name_ids, rule_indptr, rule_targets, rule_gains)
+    k = active.shape[0]
+    if k == 0:
+        return best_order, 0, 0.0
+
+    # pair_gain[i, j]: 选择 i 发出的、以选择 j 的名称为目标的影响得分之和
+    rule_sources = np.repeat(np.arange(n), np.diff(rule_indptr))
+    emitted = np.zeros((n, num_names))
+    np.add.at(emitted, (rule_sources, rule_targets), rule_gains)
+    pair_gain = emitted[np.ix_(active, name_ids[active])]
+
+    perms = _permutations(k)
+    num_perms = perms.shape[1]
+    perm_names = name_ids[active][perms]
+    gains = base_scores[active][perms] # (k, k!) 每个位置的边际得分，按位置成行 (SoA)，逐行就地累加
+    last_same = np.empty(num_perms, dtype=np.int64)
+    mask = np.empty(num_perms, dtype=bool) # 复用的布尔缓冲区，循环中不再分配临时数组
+    for p in range(1, k):
+        # 位置 q 发出的影响作用于位置 p，当且仅当 q 与 p 之间 (含 q，不含 p) 之后再没有同名动作：
+        # 即 q 不早于 p 之前最后一个同名位置 (该位置已消费更早的影响)
+        last_same.fill(0)
+        for q in range(p):
+            np.equal(perm_names[q], perm_names[p], out=mask)
+            np.copyto(last_same, q, where=mask)
+        for q in range(p):
+            np.less_equal(last_same, q, out=mask)
+            np.add(gains[p], pair_gain[perms[q], perms[p]], out=gains[p], where=mask)
+
+    scores = np.zeros((k + 1, num_perms)) # 第 0 行为空序列
+    np.cumsum(gains, axis=0, out=scores[1:])
+    best_score = scores.max()
+    candidates = scores >= best_score - SCORE_EPS
+    best_len = int(np.argmax(candidates.any(axis=1))) # 最短的近似最优长度
+    col = int(np.argmax(candidates[best_len]))        # 其中字典序最小的排列
+    best_order[:best_len] = active[perms[:best_len, col]]
+    return best_order, best_len, float(scores[best_len, col])
+
+# 未安装 numba 时，不超过该数量的选择改用按手牌结构生成的直线代码搜索 (见 unrolled_search)：
+# 3~5 个选择时比向量化枚举快约 30%；生成与编译的开销随前缀数增长 (5 个选择 325 个前缀，约 5ms，按结构缓存)，
+# 6 个选择 (1956 个前缀) 时已不划算
+UNROLL_MAX_CHOICES = 5
+
+def _unrolled_source(name_pattern: tuple, dup_pattern: tuple) -> str:
+    """
+    生成搜索函数 search(b, g) 的源码: 按 DFS 顺序逐个展开所有有序子序列 (前缀树的每个节点一段直线代码)。
+    名称与重复关系在生成时已知，所以"某个影响是否作用于某个位置"在生成时就确定了，运行时只剩加法与比较。
+    每个位置的边际得分按 score_all_orderings 的顺序累加 (基础分，再按来源位置依次加影响)，得分逐位相同。
+    """
+    k = len(name_pattern)
+    lines = ["def search(b, g):"]
+    if k == 1:
+        lines.append("    b0, = b")
+    else:
+        lines.append("    " + ", ".join(f"b{i}" for i in range(k)) + " = b")
+    for i in range(k):
+        for j in range(k):
+            if i != j:
+                lines.append(f"    g{i}_{j} = g[{i}][{j}]")
+    lines.append("    best = 0.0")
+    lines.append("    best_len = 0")
+    lines.append("    best_seq = ()")
+
+    def expand(path, parent, indent):
+        depth = len(path)
+        for i in range(k):
+            if i in path or (dup_pattern[i] >= 0 and dup_pattern[i] not in path):
+                continue
+            # 位置 q 的影响作用于新位置，当且仅当 q 不早于此前最后一个同名位置
+            last_same = 0
+            for q in range(depth):
+                if name_pattern[path[q]] == name_pattern[i]:
+                    last_same = q
+            terms = [f"b{i}"] + [f"g{path[q]}_{i}" for q in range(last_same, depth)]
+            var = "s" + "_".join(str(c) for c in path + (i,))
+            marginal = " + ".join(terms)
+            lines.append(f"{indent}{var} = {marginal}" if parent is None else f"{indent}{var} = {parent} + ({marginal})")
+            length = depth + 1
+            lines.append(f"{indent}if {var} > best + {SCORE_EPS!r} or ({var} >= best - {SCORE_EPS!r} and {length} < best_len):")
+            lines.append(f"{indent}    best = {var}")
+            lines.append(f"{indent}    best_len = {length}")
+            lines.append(f"{indent}    best_seq = {path + (i,)!r}")
+            expand(path + (i,), var, indent)
+
+    expand((), None, "    ")
+    lines.append("    return best_seq, best")
+    return "\n".join(lines) + "\n"
+
+@lru_cache(maxsize=256)
+def _compiled_searcher(name_pattern: tuple, dup_pattern: tuple):
+    """按 (名称模式, 重复模式) 生成并编译一次搜索函数"""
+    namespace = {}
+    exec(compile(_unrolled_source(name_pattern, dup_pattern), f"<unrolled-search-{len(name_pattern)}>", "exec"), namespace)
+    return namespace["search"]
+
+def unrolled_search(base_scores, name_ids, dup_prev, rule_indptr, rule_targets, rule_gains, num_names):
+    """
+    search_best_sequence 的直线代码版本 (无束搜索)，用于未安装 numba 且有效选择很少的情况。
+    名称按首次出现重新编号、重复关系改为有效选择中的位置，作为生成代码的缓存键 (与具体得分无关)。
+    返回值与 search_best_sequence 相同。
+    """
+    n = base_scores.shape[0]
+    best_order = np.zeros(n, dtype=np.int64)
+    active = _active_choices(base_scores, name_ids, rule_indptr, rule_targets, rule_gains).tolist()
+    if not active:
+        return best_order, 0, 0.0
+    position = {choice: p for p, choice in enumerate(active)}
+    canonical_names: dict = {}
+    name_pattern = tuple(canonical_names.setdefault(int(name_ids[i]), len(canonical_names)) for i in active)
+    dup_pattern = tuple(position.get(int(dup_prev[i]), -1) for i in active)
+
+    # pair_gain[p][q]: 有效选择 p 发出的、以有效选择 q 的名称为目标的影响得分之和 (与 score_all_orderings 相同)
+    rule_sources = np.repeat(np.arange(n), np.diff(rule_indptr))
+    emitted = np.zeros((n, num_names))
+    np.add.at(emitted, (rule_sources, rule_targets), rule_gains)
+    pair_gain = emitted[np.ix_(active, name_ids[active])].tolist()
+
+    best_seq, best_score = _compiled_searcher(name_pattern, dup_pattern)(base_scores[active].tolist(), pair_gain)
+    for p, choice in enumerate(best_seq):
+        best_order[p] = active[choice]
+    return best_order, len(best_seq), float(best_score)
+
+def warmup():
+    """用极小的输入调用一次各内核，触发 numba 编译 (或从缓存加载)"""
+    base_scores = np.array([1.0, 0.5])
+    name_ids = np.array([0, 1], dtype=np.int64)
+    dup_prev = np.array([-1, -1], dtype=np.int64)
+    rule_indptr = np.array([0, 1, 1], dtype=np.int64)
+    rule_targets = np.array([1], dtype=np.int64)
+    rule_gains = np.array([0.25])
+    search_best_sequence(base_scores, name_ids, dup_prev, rule_indptr, rule_targets, rule_gains, 2, 0)
+
+if HAVE_NUMBA:
+    warmup()